@@ -3,7 +3,7 @@ import sys
 from pynput import keyboard, mouse
 from glob import glob
 
-from source.inputs import InputBuffer, AutomatedMove, Move, MoveInput, Input
+from source.inputs import InputBuffer, InputRecorder, AutomatedMove, Input, load_moves, JITTER
 from source.gui.gui import GuiApplication
 from source.gui.gui import GuiHandler
 from source.gui.entry import GuiEntry
@@ -27,19 +27,22 @@ class Mapped:
 
 
 class Handler(GuiHandler):
-    def __init__(self, map, moves):
+    def __init__(self, map, moves, recorder=None, jitter=JITTER):
         self.running = True
         self.key2action_map = {k: v.get_action() for k, v in map.items()}
         self.action2color_map = {v.get_action(): v.get_color() for v in map.values()}
         self.action2acolor_map = {v.get_action(): v.get_acolor() for v in map.values()}
         self.action2key_map = {v.get_action(): k for k, v in map.items()}
         self.moves = moves
-        self.buffer = InputBuffer()
+        self.recorder = recorder
+        self.buffer = InputBuffer(jitter)
         self.available_moves = self.moves[:]
         self.automated_input = None
         self.kb_controller = keyboard.Controller()
         self.ms_controller = mouse.Controller()
         self.moves_counter = 0
+        self.repeats_counter = 0
+        self.held_keys = {}
         self.clear = False
 
     def run(self):
@@ -47,6 +50,11 @@ class Handler(GuiHandler):
         self._process_automated(ts)
         return self._process_manual(ts)
 
+    def stop(self):
+        # Called from the worker once it stopped running, so nothing is recorded anymore
+        if self.recorder:
+            self.recorder.close()
+
     def _get_available_colors(self):
         return list(self.action2color_map.values()) + ["#19EEE7"]
 
@@ -77,15 +85,28 @@ class Handler(GuiHandler):
             self.clear = False
         return entries, clear, self.running
 
+    def _create_move_input(self, move):
+        self.moves_counter += 1
+        return Input(f"[{move.get_accumulated_delay()}]{move.name}", 1, derived=True)
+
     def _process_manual(self, ts):
         inputs = []
-        if input := self.buffer.pop():
-            inputs.append(input)
-            for move in self.moves:
-                if move.is_executed(input):
-                    self.moves_counter += 1
-                    inputs.append(Input(f"[{move.get_accumulated_delay()}]{move.name}", 1, derived=True))
+        for move in self.moves:
+            if move.is_completed(ts):
+                inputs.append(self._create_move_input(move))
 
+        if input := self.buffer.pop(ts):
+            inputs.append(input)
+            # A late input is shown but its delay is meaningless for matching and mining
+            if not input.is_late():
+                if self.recorder:
+                    self.recorder.record(input)
+                for move in self.moves:
+                    if move.is_executed(input):
+                        inputs.append(self._create_move_input(move))
+
+        if self.recorder:
+            self.recorder.flush(ts)
         return self._create_gui_entries(inputs)
 
     def _process_automated(self, ts):
@@ -117,6 +138,7 @@ class Handler(GuiHandler):
 
         if key == "+":
             self.buffer.clear()
+            self.held_keys.clear()
             self.clear = True
 
         if key == "-":
@@ -125,19 +147,60 @@ class Handler(GuiHandler):
         if key == "*":
             self.automated_input = AutomatedMove("Automated", self._find_move("Reloadshot").inputs)
 
+    def _handle_release(self, key_id):
+        ts = utils.get_timestamp_ms()
+        # The release is matched to the key as it was pressed, shift or caps lock may have changed it since
+        key = self.held_keys.pop(key_id, None)
+        if key in self.key2action_map:
+            self.buffer.release(self.key2action_map[key], ts)
+
+    def _handle_press(self, key_id, key):
+        # The OS repeats press events while a key is held, only the first one is an input
+        if key_id in self.held_keys:
+            self.repeats_counter += 1
+            return
+        self.held_keys[key_id] = key
+        self._handle_key(key)
+
+    def _normalize_key(self, key):
+        return key.char if hasattr(key, 'char') and key.char else key
+
+    def _get_key_id(self, key):
+        # Identifies the physical key independent of the modifiers
+        if hasattr(key, 'char') and key.char:
+            return key.char.lower()
+        if hasattr(key, 'vk') and key.vk is not None:
+            return key.vk
+        return key
+
     def on_press(self, key):
-        self._handle_key(key.char if hasattr(key, 'char') and key.char else key)
+        self._handle_press(self._get_key_id(key), self._normalize_key(key))
         return self.running
 
     def on_release(self, key):
+        self._handle_release(self._get_key_id(key))
         return self.running
 
     def on_click(self, x, y, button, pressed):
         if pressed:
-            self._handle_key(button)
+            self._handle_press(button, button)
+        else:
+            self._handle_release(button)
         return self.running
 
 
+def get_jitter(argv):
+    if "--jitter" not in argv:
+        return JITTER
+    try:
+        jitter = int(argv[argv.index("--jitter") + 1])
+    except (IndexError, ValueError):
+        jitter = -1
+    if jitter < 0:
+        sys.exit("--jitter expects a non-negative number of milliseconds")
+    return jitter
+
+
 def start_keyboard_listener(handler):
     with keyboard.Listener(on_press=handler.on_press, on_release=handler.on_release) as listener:
         listener.join()
@@ -148,21 +211,6 @@ def start_mouse_listener(handler):
         listener.join()
 
 
-def load_moves(filenames):
-    moves = []
-    for filename in filenames:
-        print(filename)
-        for name, values in utils.load_json(filename).items():
-            move = Move(name, [MoveInput(input["input"],
-                                         input["max.delay"] if "max.delay" in input else 2 ** 33,
-                                         input["min.delay"] if "min.delay" in input else 0)
-                               for input in values])
-            moves.append(move)
-            print(move)
-
-    return moves
-
-
 if __name__ == "__main__":
     mappings = {
         "w": Mapped("↑", "#FFAA00", "#000000"),
@@ -179,8 +227,14 @@ if __name__ == "__main__":
         mouse.Button.middle: Mapped("G", "#D268FF", "#FFFFFF"),
     }
 
+    # Inputs from both listeners are held back this many ms to be ordered by their capture time
+    jitter = get_jitter(sys.argv)
+
+    # Inputs are appended to a log that can be mined for new moves with mine.py
+    recorder = InputRecorder("inputs.log") if "--record" in sys.argv else None
+
     # Start keyboard and mouse listeners in separate threads
-    handler = Handler(mappings, load_moves(glob('moves/**/*.json', recursive=True)))
+    handler = Handler(mappings, load_moves(glob('moves/**/*.json', recursive=True)), recorder, jitter)
     keyboard_thread = threading.Thread(target=start_keyboard_listener, args=(handler,))
     mouse_thread = threading.Thread(target=start_mouse_listener, args=(handler,))
     keyboard_thread.start()
@@ -191,3 +245,6 @@ if __name__ == "__main__":
 
     keyboard_thread.join()
     mouse_thread.join()
+
+    print(f"{handler.repeats_counter} key repeats suppressed")
+    print(f"{handler.buffer.get_reordered()} inputs reordered, {handler.buffer.get_late()} arrived too late to be ordered")
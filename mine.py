@@ -0,0 +1,44 @@
+import argparse
+import json
+from glob import glob
+
+from source.inputs import load_moves
+from source.mining import InputLog, SequenceMiner
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mines recorded inputs for frequent sequences and proposes them as moves")
+    parser.add_argument("logs", nargs="+", help="input logs recorded with 'app.py --record'")
+    parser.add_argument("--moves", default="moves", help="directory with the known moves")
+    parser.add_argument("--output", help="json file the candidate moves are written to")
+    parser.add_argument("--min-support", type=int, default=50, help="minimum number of occurrences")
+    parser.add_argument("--min-length", type=int, default=2, help="minimum number of inputs of a move")
+    parser.add_argument("--max-length", type=int, default=8, help="maximum number of inputs of a move")
+    parser.add_argument("--max-gap", type=int, default=1000, help="maximum delay between two inputs of a move in ms")
+    parser.add_argument("--max-spread", type=int, default=150, help="maximum width of a delay window in ms")
+    parser.add_argument("--limit", type=int, default=20, help="maximum number of candidates")
+    args = parser.parse_args()
+    if args.max_length < args.min_length or args.min_length < 2:
+        parser.error("--min-length must be at least 2 and not above --max-length")
+
+    log = InputLog()
+    for filename in args.logs:
+        try:
+            log.load(filename)
+        except ValueError as e:
+            parser.error(str(e))
+    print(f"{len(log)} inputs loaded")
+
+    moves = load_moves(glob(f"{args.moves}/**/*.json", recursive=True))
+    try:
+        miner = SequenceMiner(log, min_support=args.min_support, min_length=args.min_length, max_length=args.max_length,
+                              max_gap=args.max_gap, max_spread=args.max_spread)
+    except ValueError as e:
+        parser.error(f"--max-length {args.max_length} is too long: {e}")
+    candidates = miner.mine(moves)[:args.limit]
+    for candidate in candidates:
+        print(candidate)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf8") as f:
+            json.dump({c.get_name(): c.to_json() for c in candidates}, f, indent=4, ensure_ascii=False)
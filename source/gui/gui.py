@@ -19,6 +19,9 @@ class GuiHandler:
     def run(self):
         raise NotImplementedError()
 
+    def stop(self):
+        pass
+
 
 class Worker(QObject):
     finished = pyqtSignal()
@@ -40,6 +43,7 @@ class Worker(QObject):
             if not running:
                 break
 
+        self.handler.stop()
         self.finished.emit()
 
 
@@ -1,15 +1,44 @@
+import heapq
+import threading
 import source.utils as utils
 
+# Default time in ms inputs are held back to be ordered by their capture time
+JITTER = 10
+
 
 class Input:
-    def __init__(self, action, delay, derived=False):
+    def __init__(self, action, delay, derived=False, timestamp=0):
         self.action = action
         self.delay = delay
         self.derived = derived
+        self.timestamp = timestamp
+        self.duration = None
+        self.late = False
 
     def is_derived(self):
         return self.derived
 
+    def is_late(self):
+        return self.late
+
+    def set_late(self):
+        self.late = True
+
+    def set_delay(self, delay):
+        self.delay = delay
+
+    def is_held(self):
+        return self.duration is None
+
+    def set_duration(self, duration):
+        self.duration = duration
+
+    def get_duration(self):
+        return self.duration
+
+    def get_timestamp(self):
+        return self.timestamp
+
     def get_action(self):
         return self.action
 
@@ -17,14 +46,18 @@ class Input:
         return self.delay
 
     def __str__(self):
-        return f"{self.action:6}({self.delay:3})"
+        if self.duration is None:
+            return f"{self.action:6}({self.delay:3})"
+        return f"{self.action:6}({self.delay:3}/{self.duration:3})"
 
 
 class MoveInput():
-    def __init__(self, accepted_actions, max_delay, min_delay):
+    def __init__(self, accepted_actions, max_delay, min_delay, max_duration=2 ** 33, min_duration=0):
         self.actions = accepted_actions.split("|")
         self.max_delay = max_delay
         self.min_delay = min_delay
+        self.max_duration = max_duration
+        self.min_duration = min_duration
 
     def get_starting_action(self):
         return self.actions[0]
@@ -32,6 +65,23 @@ class MoveInput():
     def get_min_delay(self):
         return self.min_delay
 
+    def get_hold_duration(self):
+        lo = self.min_duration or min(50, self.max_duration)
+        hi = min(self.max_duration, max(lo + 50, 100))
+        return utils.get_random(lo, hi)
+
+    def is_held_for(self, input, ts):
+        # Returns None while the key is still down at ts and the duration can not be decided yet
+        duration = input.get_duration()
+        if duration is None or input.get_timestamp() + duration > ts:
+            held = ts - input.get_timestamp()
+            if held > self.max_duration:
+                return False
+            if held < self.min_duration or self.max_duration < 2 ** 33:
+                return None
+            return True
+        return self.min_duration <= duration <= self.max_duration
+
     def is_executed(self, input):
         return (self.min_delay <= input.delay <= self.max_delay) and input.action in self.actions
 
@@ -45,17 +95,23 @@ class Move:
         self.inputs = inputs
         self.next = 0
         self.accumulated_delay = 0
+        self.last_input = None
+        self.completed = None
+        self.completed_delay = 0
 
     def _execute(self, input):
         if self.next == 0:
             if self.inputs[0].is_executed(input):
                 self.accumulated_delay = 0
                 self.next += 1
+                self.last_input = input
                 return True
             return False
 
-        elif self.next < len(self.inputs) and self.inputs[self.next].is_executed(input):
+        # The duration of the previous input must be decided by the time the next one is pressed
+        elif self.next < len(self.inputs) and self.inputs[self.next - 1].is_held_for(self.last_input, input.get_timestamp()) and self.inputs[self.next].is_executed(input):
             self.next += 1
+            self.last_input = input
             self.accumulated_delay += input.get_delay()
             return True
         else:
@@ -63,13 +119,25 @@ class Move:
             return self._execute(input)
 
     def get_accumulated_delay(self):
-        return self.accumulated_delay
+        return self.completed_delay
 
     def is_executed(self, input):
         if self._execute(input):
             if self.next == len(self.inputs):
+                # Completing the sequence again replaces one that still waits for its last duration
                 self.next = 0
-                return True
+                self.completed = input
+                self.completed_delay = self.accumulated_delay
+                return self.is_completed(input.get_timestamp())
+        return False
+
+    def is_completed(self, ts):
+        # The last input completes the move only once its duration is decided
+        if self.completed:
+            held = self.inputs[-1].is_held_for(self.completed, ts)
+            if held is not None:
+                self.completed = None
+                return held
         return False
 
     def __str__(self):
@@ -86,6 +154,7 @@ class AutomatedMove:
         self.timestamp = 0
         self.executed = 0
         self.pressed = False
+        self.hold = 0
 
     def can_be_executed(self, ts):
         return self.timestamp + self.inputs[self.executed].min_delay < ts
@@ -96,13 +165,14 @@ class AutomatedMove:
     def set_pressed(self, timestamp):
         self.pressed = True
         self.timestamp = timestamp
+        self.hold = self.inputs[self.executed].get_hold_duration()
 
     def set_released(self):
         self.pressed = False
         self.executed += 1
 
     def needs_releasing(self, ts):
-        return self.pressed and (ts - self.timestamp) > utils.get_random(50, 100)
+        return self.pressed and (ts - self.timestamp) >= self.hold
 
     def is_pressed(self):
         return self.pressed
@@ -112,23 +182,98 @@ class AutomatedMove:
 
 
 class InputBuffer:
-    def __init__(self):
+    # Keyboard and mouse inputs arrive from separate threads, so they are held back for a short
+    # jitter window and released in the order they were captured instead of the order they arrived
+    def __init__(self, jitter=JITTER):
+        self.jitter = jitter
+        self.lock = threading.Lock()
         self.pending = []
+        self.held = {}
         self.timestamp = 0
+        self.latest = 0
+        self.sequence = 0
+        self.reordered = 0
+        self.late = 0
 
     def clear(self):
-        self.pending = []
-        self.timestamp = 0
+        with self.lock:
+            self.pending = []
+            self.held = {}
+            self.timestamp = 0
+            self.latest = 0
 
     def add(self, key, ts):
-        delay = ts - self.timestamp
-        self.timestamp = ts
-        self.pending.append(Input(key, delay))
-
-    def pop(self):
-        if self.pending:
-            return self.pending.pop(0)
+        with self.lock:
+            if ts < self.latest:
+                self.reordered += 1
+            self.latest = max(self.latest, ts)
+            input = Input(key, 0, timestamp=ts)
+            self.held[key] = input
+            heapq.heappush(self.pending, (ts, self.sequence, input))
+            self.sequence += 1
+
+    def release(self, key, ts):
+        with self.lock:
+            if key in self.held:
+                input = self.held.pop(key)
+                input.set_duration(ts - input.get_timestamp())
+
+    def pop(self, now):
+        with self.lock:
+            if self.pending and self.pending[0][0] <= now - self.jitter:
+                ts, _, input = heapq.heappop(self.pending)
+                # Inputs that arrive after the jitter window can not be ordered anymore
+                if ts < self.timestamp:
+                    self.late += 1
+                    input.set_late()
+                input.set_delay(max(ts - self.timestamp, 0))
+                self.timestamp = max(self.timestamp, ts)
+                return input
         return []
 
+    def get_reordered(self):
+        return self.reordered
+
+    def get_late(self):
+        return self.late
+
     def __str__(self):
-        return " + ".join([str(input) for input in (self.pending)])
+        return " + ".join([str(input) for _, _, input in sorted(self.pending)])
+
+
+class InputRecorder:
+    # Inputs are recorded in the order they leave the InputBuffer and written once they are released
+    def __init__(self, filename, timeout=5000):
+        self.file = open(filename, "a", encoding="utf8")
+        self.timeout = timeout
+        self.pending = []
+
+    def record(self, input):
+        self.pending.append(input)
+
+    def flush(self, ts):
+        while self.pending and (not self.pending[0].is_held() or ts - self.pending[0].get_timestamp() > self.timeout):
+            input = self.pending.pop(0)
+            duration = "" if input.is_held() else input.get_duration()
+            self.file.write(f"{input.get_timestamp()}\t{input.get_action()}\t{input.get_delay()}\t{duration}\n")
+
+    def close(self):
+        self.flush(2 ** 63)
+        self.file.close()
+
+
+def load_moves(filenames):
+    moves = []
+    for filename in filenames:
+        print(filename)
+        for name, values in utils.load_json(filename).items():
+            move = Move(name, [MoveInput(input["input"],
+                                         input["max.delay"] if "max.delay" in input else 2 ** 33,
+                                         input["min.delay"] if "min.delay" in input else 0,
+                                         input["max.duration"] if "max.duration" in input else 2 ** 33,
+                                         input["min.duration"] if "min.duration" in input else 0)
+                               for input in values])
+            moves.append(move)
+            print(move)
+
+    return moves
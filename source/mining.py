@@ -0,0 +1,218 @@
+from array import array
+
+# Delay of the first input of a session and duration of an input that was never released
+UNKNOWN = 2 ** 32 - 1
+
+
+class InputLog:
+    # Inputs are kept integer encoded so tens of millions of them fit in a few bytes each
+    def __init__(self):
+        self.action2code = {}
+        self.code2action = []
+        self.codes = array("B")
+        self.delays = array("I")
+        self.durations = array("I")
+        self.timestamp = None
+
+    def _encode(self, action):
+        if action not in self.action2code:
+            self.action2code[action] = len(self.code2action)
+            self.code2action.append(action)
+        return self.action2code[action]
+
+    def add(self, action, ts, duration=None, delay=None):
+        if self.timestamp is None:
+            delay = UNKNOWN
+        elif delay is None:
+            delay = max(ts - self.timestamp, 0)
+        self.timestamp = ts
+        self.codes.append(self._encode(action))
+        self.delays.append(min(delay, UNKNOWN))
+        self.durations.append(UNKNOWN if duration is None else min(duration, UNKNOWN - 1))
+
+    def load(self, filename):
+        # Every file is a separate session, the first input of it does not continue the previous one
+        self.timestamp = None
+        with open(filename, "r", encoding="utf8") as f:
+            for number, line in enumerate(f, 1):
+                if line := line.rstrip("\n"):
+                    fields = line.split("\t")
+                    if len(fields) != 4:
+                        raise ValueError(f"{filename}:{number}: expected timestamp, action, delay and duration")
+                    ts, action, delay, duration = fields
+                    self.add(action, int(ts), int(duration) if duration else None, int(delay))
+
+    def decode(self, key, length):
+        actions = []
+        for _ in range(length):
+            key, code = divmod(key, len(self.code2action))
+            actions.append(self.code2action[code])
+        return actions[::-1]
+
+    def __len__(self):
+        return len(self.codes)
+
+
+class DelayHistogram:
+    def __init__(self, bucket):
+        self.bucket = bucket
+        self.counts = {}
+        self.total = 0
+
+    def add(self, delay):
+        index = delay // self.bucket
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.total += 1
+
+    def get_percentile(self, percentile):
+        target = self.total * percentile / 100
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= target:
+                return index * self.bucket
+        return 0
+
+
+class Candidate:
+    def __init__(self, actions, support, windows, durations):
+        self.actions = actions
+        self.support = support
+        self.windows = windows
+        self.durations = durations
+
+    def get_name(self):
+        return "?[" + " ".join(self.actions) + "]"
+
+    def is_known(self, moves, partial=True):
+        # Parts of a known move are known as well
+        length = len(self.actions)
+        for move in moves:
+            if not partial and len(move.inputs) != length:
+                continue
+            for start in range(len(move.inputs) - length + 1):
+                if all(action in input.actions for action, input in zip(self.actions, move.inputs[start:])):
+                    return True
+        return False
+
+    def is_repetition(self, candidates, moves):
+        # Performing a move several times in a row is not a new move
+        length = len(self.actions)
+        for period in range(1, length // 2 + 1):
+            unit = self.actions[:period]
+            if length % period == 0 and self.actions == unit * (length // period):
+                if tuple(unit) in candidates or Candidate(unit, 0, [], []).is_known(moves, partial=False):
+                    return True
+        return False
+
+    def to_json(self):
+        values = [{"input": self.actions[0]}]
+        for action, (min_delay, max_delay) in zip(self.actions[1:], self.windows):
+            values.append({"min.delay": min_delay, "max.delay": max_delay, "input": action})
+        for value, duration in zip(values, self.durations):
+            if duration:
+                value["min.duration"], value["max.duration"] = duration
+        return values
+
+    def __str__(self):
+        steps = [self.actions[0]] + [f"{action}({lo}-{hi})" for action, (lo, hi) in zip(self.actions[1:], self.windows)]
+        return f"{self.support:8} x " + " + ".join(steps)
+
+
+class SequenceMiner:
+    def __init__(self, log, min_support=50, min_length=2, max_length=8, max_gap=1000,
+                 max_spread=150, bucket=10, percentiles=(5, 95), closed_ratio=0.9):
+        self.log = log
+        self.min_support = min_support
+        self.min_length = min_length
+        self.max_length = max_length
+        self.max_gap = max_gap
+        self.max_spread = max_spread
+        self.bucket = bucket
+        self.percentiles = percentiles
+        self.closed_ratio = closed_ratio
+        # Occurrences are keyed by their actions packed into one 64 bit number
+        if max(len(log.code2action), 1) ** max_length >= 2 ** 64:
+            raise ValueError(f"sequences of {max_length} out of {len(log.code2action)} actions can not be mined")
+
+    def _extend(self, positions, keys, length):
+        # Pseudo projection: only occurrences of frequent (length - 1)-grams are grown by one input,
+        # so memory is bounded by the number of surviving occurrences and never by the pattern space
+        codes, delays = self.log.codes, self.log.delays
+        alphabet = len(self.log.code2action)
+        end = len(codes) - length + 1
+        next_positions, next_keys = array("I"), array("Q")
+        counts = {}
+        for position, key in zip(positions, keys):
+            last = position + length - 1
+            if position < end and delays[last] <= self.max_gap:
+                key = key * alphabet + codes[last]
+                counts[key] = counts.get(key, 0) + 1
+                next_positions.append(position)
+                next_keys.append(key)
+
+        frequent = {key: count for key, count in counts.items() if count >= self.min_support}
+        positions, keys = array("I"), array("Q")
+        for position, key in zip(next_positions, next_keys):
+            if key in frequent:
+                positions.append(position)
+                keys.append(key)
+        return positions, keys, frequent
+
+    def _get_window(self, histogram):
+        lo, hi = self.percentiles
+        return histogram.get_percentile(lo), histogram.get_percentile(hi) + self.bucket
+
+    def _collect_windows(self, positions, keys, frequent, length):
+        delays, durations = self.log.delays, self.log.durations
+        histograms = {key: [DelayHistogram(self.bucket) for _ in range(length - 1)] for key in frequent}
+        holds = {key: [DelayHistogram(self.bucket) for _ in range(length)] for key in frequent}
+        for position, key in zip(positions, keys):
+            for step, histogram in enumerate(histograms[key], 1):
+                histogram.add(delays[position + step])
+            for step, histogram in enumerate(holds[key]):
+                if durations[position + step] != UNKNOWN:
+                    histogram.add(durations[position + step])
+
+        windows = {}
+        for key, steps in histograms.items():
+            window = [self._get_window(h) for h in steps]
+            if all(max_delay - min_delay <= self.max_spread for min_delay, max_delay in window):
+                # Hold durations are only suggested where they are as consistent as the delays
+                duration = [self._get_window(h) if h.total >= self.min_support else None for h in holds[key]]
+                duration = [d if d and d[1] - d[0] <= self.max_spread else None for d in duration]
+                windows[key] = window, duration
+        return windows
+
+    def mine(self, moves=[]):
+        counts = {}
+        for code in self.log.codes:
+            counts[code] = counts.get(code, 0) + 1
+        frequent = {key: count for key, count in counts.items() if count >= self.min_support}
+        positions = array("I", (i for i, code in enumerate(self.log.codes) if code in frequent))
+        keys = array("Q", (self.log.codes[i] for i in positions))
+
+        candidates = {}
+        alphabet = max(len(self.log.code2action), 1)
+        for length in range(2, self.max_length + 1):
+            if not frequent:
+                break
+            positions, keys, frequent = self._extend(positions, keys, length)
+
+            # A prefix or suffix that is almost always part of the longer sequence is not a move of its own
+            for key, count in frequent.items():
+                for part in (key // alphabet, key % alphabet ** (length - 1)):
+                    if count >= counts.get(part, 0) * self.closed_ratio:
+                        candidates.pop((part, length - 1), None)
+            counts = frequent
+
+            if length < self.min_length:
+                continue
+            for key, (window, duration) in self._collect_windows(positions, keys, frequent, length).items():
+                candidate = Candidate(self.log.decode(key, length), frequent[key], window, duration)
+                if not candidate.is_known(moves):
+                    candidates[(key, length)] = candidate
+
+        units = {tuple(c.actions) for c in candidates.values()}
+        candidates = [c for c in candidates.values() if not c.is_repetition(units, moves)]
+        return sorted(candidates, key=lambda c: c.support * len(c.actions), reverse=True)